@@ -12,38 +12,158 @@ are way too many parses out there already.
 """
 from __future__ import annotations
 import collections
-import dataclasses
+import mmap
 import os
 import struct
 
+_BOX_HDR = struct.Struct(">I4s")
+_LARGE = struct.Struct(">Q")
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+# Fixed-width unsigned ints by byte width. Other widths (like 24-bit
+# flags or 0-byte iloc fields) fall back to int.from_bytes.
+_UINTS = {1: _U8, 2: _U16, 4: _U32, 8: _U64}
+_RESOLUTION = struct.Struct(">II")
+# iloc: 4-bit offset_size, length_size and base_offset_size, 4 reserved
+# bits, then 16-bit item_count.
+_ILOC_HDR = struct.Struct(">HH")
+# iloc item: 16-bit item_ID and data_reference_index.
+_ILOC_ITEM = struct.Struct(">HH")
+# Below this many extents per item NumPy's call overhead isn't worth it.
+_NUMPY_MIN_EXTENTS = 64
+# NumPy is optional and slow to import, so it's imported on first use
+# by _get_numpy(). None until then, or if it isn't installed.
+_numpy = None
+_numpy_imported = False
+
+# Copies at least this long are done in-kernel when possible. Shorter
+# ones aren't worth flushing the output for.
+_COPY_IN_KERNEL_MIN = 64 * 1024
+_COPY_CHUNK = 1024 * 1024
+
+def _get_numpy():
+    global _numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            pass
+    return _numpy
+
 class StructuredFile(object):
     def __init__(self, fh):
         """
         * fh: Must be seekable.
         """
         self.fh = fh
+        # Track the position here so tell() needn't be a syscall.
+        self._pos = fh.tell()
+        # Reused by copy_to() so copies don't allocate per call.
+        self._copy_buf = bytearray()
+
+    def fileno(self):
+        return self.fh.fileno()
 
-    def __getattr__(self, attr):
-        return getattr(self.fh, attr)
+    def close(self):
+        self.fh.close()
+
+    def tell(self):
+        return self._pos
 
     def seek(self, n_bytes, whence):
         # Make the "whence" argument explicit and mandatory to reduce bugs.
-        return self.fh.seek(n_bytes, whence)
+        self._pos = self.fh.seek(n_bytes, whence)
+        return self._pos
 
     def read(self, n_bytes):
-        buf = self.fh.read(n_bytes)
+        buf = self.read_upto(n_bytes)
         if len(buf) != n_bytes:
             raise EOFError(self)
         return buf
 
-    def read_struct(self, fmt):
-        n_bytes = struct.calcsize(fmt)
-        buf = self.read(n_bytes)
-        return struct.unpack(fmt, buf)[0]
+    def read_upto(self, n_bytes):
+        """
+        Like read() but returns a short buffer at EOF instead of raising.
+        """
+        buf = self.fh.read(n_bytes)
+        self._pos += len(buf)
+        return buf
+
+    def readinto(self, buf):
+        n_bytes = self.fh.readinto(buf)
+        self._pos += n_bytes
+        return n_bytes
+
+    def copy_to(self, out_fh, n_bytes):
+        """
+        Copy n_bytes from the current position to out_fh without
+        holding them all in RAM.
+        """
+        if n_bytes >= _COPY_IN_KERNEL_MIN:
+            if self._copy_in_kernel(out_fh, n_bytes):
+                return
+        if len(self._copy_buf) < min(n_bytes, _COPY_CHUNK):
+            self._copy_buf = bytearray(min(n_bytes, _COPY_CHUNK))
+        with memoryview(self._copy_buf) as view:
+            while n_bytes > 0:
+                n_read = self.readinto(view[:min(n_bytes, len(view))])
+                if n_read == 0:
+                    raise EOFError(self)
+                out_fh.write(view[:n_read])
+                n_bytes -= n_read
+
+    def _copy_in_kernel(self, out_fh, n_bytes):
+        """
+        Copy with os.copy_file_range(). Returns False, having copied
+        nothing, if either file doesn't support it.
+        """
+        if not hasattr(os, "copy_file_range"):
+            return False
+        try:
+            in_fd = self.fh.fileno()
+            out_fd = out_fh.fileno()
+        except (AttributeError, OSError):
+            return False
+        # Anything buffered must land before the copied bytes.
+        out_fh.flush()
+        offset = self._pos
+        end = offset + n_bytes
+        while offset < end:
+            try:
+                copied = os.copy_file_range(
+                    in_fd, out_fd, end - offset, offset_src=offset)
+            except OSError:
+                if offset == self._pos:
+                    return False
+                raise
+            if copied == 0:
+                raise EOFError(self)
+            offset += copied
+        # copy_file_range() doesn't move the input's file position.
+        self.seek(end, os.SEEK_SET)
+        return True
+
+    def read_struct(self, unpacker):
+        """
+        Returns the first field unpacked by a struct.Struct.
+
+        Build the Struct once at module level, like _U32, rather than
+        per call; parsing format strings is slower than the read.
+        """
+        buf = self.read(unpacker.size)
+        return unpacker.unpack(buf)[0]
 
     def read_int(self, n_bytes):
         buf = self.read(n_bytes)
-        return int.from_bytes(buf, "big")
+        unpacker = _UINTS.get(n_bytes)
+        if unpacker is None:
+            return int.from_bytes(buf, "big")
+        return unpacker.unpack(buf)[0]
 
     def read_ascii(self, n_bytes):
         buf = self.read(n_bytes)
@@ -65,26 +185,132 @@ class StructuredFile(object):
         self.fh.seek(pos, os.SEEK_SET)
         return end
 
+class MappedStructure(StructuredFile):
+    """
+    StructuredFile reading from an mmap of fh, so reads and seeks are
+    slices and arithmetic instead of syscalls. Pages are loaded on
+    demand, so the file still needn't fit in RAM.
+    """
+    def __init__(self, fh):
+        """
+        * fh: Must be a regular, non-empty file.
+        """
+        super().__init__(fh)
+        self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+        super().close()
+
+    def seek(self, n_bytes, whence):
+        if whence == os.SEEK_SET:
+            pos = n_bytes
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + n_bytes
+        elif whence == os.SEEK_END:
+            pos = len(self._mmap) + n_bytes
+        else:
+            raise ValueError("whence", whence)
+        if pos < 0:
+            raise ValueError("negative seek position", pos)
+        self._pos = pos
+        return pos
+
+    def read_upto(self, n_bytes):
+        buf = self._mmap[self._pos:(self._pos + n_bytes)]
+        self._pos += len(buf)
+        return buf
+
+    def readinto(self, buf):
+        view = self._view[self._pos:(self._pos + len(buf))]
+        n_bytes = len(view)
+        memoryview(buf)[:n_bytes] = view
+        self._pos += n_bytes
+        return n_bytes
+
+    def read_int(self, n_bytes):
+        unpacker = _UINTS.get(n_bytes)
+        if unpacker is None:
+            return super().read_int(n_bytes)
+        if self._pos + n_bytes > len(self._mmap):
+            raise EOFError(self)
+        value = unpacker.unpack_from(self._mmap, self._pos)[0]
+        self._pos += n_bytes
+        return value
+
+    def copy_to(self, out_fh, n_bytes):
+        if n_bytes >= _COPY_IN_KERNEL_MIN:
+            if self._copy_in_kernel(out_fh, n_bytes):
+                return
+        view = self._view[self._pos:(self._pos + n_bytes)]
+        if len(view) != n_bytes:
+            raise EOFError(self)
+        out_fh.write(view)
+        self._pos += n_bytes
+
+    def peek(self, sz, at_pos=None):
+        if at_pos is None:
+            at_pos = self._pos
+        return self._mmap[at_pos:(at_pos + sz)]
+
+    def get_total_length(self):
+        return len(self._mmap)
+
 class BoxFormatError(ValueError): pass
 
-@dataclasses.dataclass
 class Box(object):
     # Box is not an ABC so it can be used for partial parsing of
     # unknown box types.
-    type: str
-    structure: StructuredFile
-    start: int
-    end: int
-    payload_start: int
-    children: list[Box] = dataclasses.field(default_factory=list)
+
+    # Slots because files can have many boxes. Subclasses should declare
+    # empty __slots__ too, or instances get a __dict__ anyway.
+    __slots__ = ("type", "structure", "start", "end", "payload_start",
+                 "children")
+
+    def __init__(self, type, structure, start, end, payload_start,
+                 children=None):
+        self.type = type
+        self.structure = structure
+        self.start = start
+        self.end = end
+        self.payload_start = payload_start
+        self.children = [] if children is None else children
+
+    def _fields(self):
+        return (self.type, self.structure, self.start, self.end,
+                self.payload_start, self.children)
+
+    def __repr__(self):
+        return (
+            "{}(type={!r}, structure={!r}, start={!r}, end={!r}, "
+            "payload_start={!r}, children={!r})"
+        ).format(type(self).__qualname__, *self._fields())
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
 
     def __str__(self):
         return "Box(type={}, size={})".format(
             self.type, (self.end - self.start))
 
-    def get_payload(self):
-        self.structure.seek(self.payload_start, os.SEEK_SET)
-        return self.structure.read(self.end - self.payload_start)
+    def get_payload(self, max_bytes=None):
+        """
+        Returns the payload, or only its first max_bytes if given.
+        Doesn't move the position.
+        """
+        n_bytes = self.end - self.payload_start
+        if max_bytes is not None:
+            n_bytes = min(n_bytes, max_bytes)
+        buf = self.structure.peek(n_bytes, at_pos=self.payload_start)
+        if len(buf) != n_bytes:
+            raise EOFError(self.structure)
+        return buf
 
     def append(self, box):
         self.children.append(box)
@@ -96,19 +322,23 @@ class Box(object):
         self.parse_seek_to_payload()
 
     def parse_children(self):
-        pass
+        """
+        Called by parse_box() after the header. Return True to have
+        parse_box() parse child boxes from the current position to the
+        box end. Otherwise parse_box() skips to the box end.
+        """
+        return False
 
 class ContainerMixin(object):
+    __slots__ = ()
+
     def parse_children(self):
         self.parse_seek_to_children()
-        structure = self.structure
-        while structure.tell() < self.end:
-            box = parse_box(structure)
-            self.children.append(box)
-        if structure.tell() != self.end:
-            raise BoxFormatError("Children beyond box end", self)
+        return True
 
 class FullBox(Box):
+    __slots__ = ()
+
     def parse_seek_to_payload(self):
         offset = (8 + 24) // 8  # 8-bit version and 24-bit flags fields
         self.structure.seek(self.payload_start + offset, os.SEEK_SET)
@@ -127,26 +357,27 @@ BOX_CLASSES: Dict[str, type] = {}
 def register_boxtype(boxtype):
     def registrar(implementing_class):
         BOX_CLASSES[boxtype] = implementing_class
-        implementing_class.type = dataclasses.field(default=boxtype)
         return implementing_class
     return registrar
 
 @register_boxtype("ftyp")
 class FileTypeBox(Box):
+    __slots__ = ()
+
     def parse_brands(self):
         self.parse_seek_to_payload()
-        structure = self.structure
-        brand = structure.read_ascii(4)
-        brands = set((brand,))
-        structure.seek(4, os.SEEK_CUR) # Skip minor version.
-        while structure.tell() < self.end:
-            compatible_brand = structure.read_ascii(4)
-            brands.add(compatible_brand)
+        buf = self.structure.read(self.end - self.payload_start)
+        # Every field is 4 bytes. Skip minor version at offset 4.
+        brands = {
+            buf[i:i + 4].decode("ascii")
+            for i in range(0, len(buf), 4)
+            if i != 4
+        }
         return brands
 
 @register_boxtype("meta")
 class MetaBox(ContainerMixin, FullBox):
-    pass
+    __slots__ = ()
 
 def parse_box_list(structure):
     i = 0
@@ -159,35 +390,51 @@ def parse_box_list(structure):
     return boxes
 
 def parse_box(structure):
-    start = structure.tell()
-    end = None
-    try:
-        sz = structure.read_int(4)
-    except EOFError:
+    """
+    Parse one box and everything nested in it. Returns None at EOF.
+    """
+    box = parse_box_header(structure)
+    if box is None:
         return None
-
-    try:
-        boxtype = structure.read_ascii(4)
-    except EOFError:
-        # Ignore trailing NULLs at EOF.
-        if sz == 0:
-            return None
+    # Containers whose children are still being parsed, innermost last.
+    # An explicit stack avoids a Python frame per nesting level.
+    open_boxes = []
+    current = box
+    while True:
+        if current is None:
+            pass
+        elif current.parse_children():
+            open_boxes.append(current)
         else:
-            raise
-
-    if sz == 0:
-        # Box extends to EOF.
-        end = structure.get_total_length()
-        sz = end - start
-    elif sz == 1:
-        # Large box.
-        sz = structure.read_int(8)
-    elif sz < 4:
+            # Usually already there; skip the syscall if so.
+            if structure.tell() != current.end:
+                structure.seek(current.end, os.SEEK_SET)
+        if not open_boxes:
+            return box
+        parent = open_boxes[-1]
+        pos = structure.tell()
+        if pos < parent.end:
+            current = parse_box_header(structure)
+            if current is None:
+                raise EOFError(structure)
+            parent.children.append(current)
+        else:
+            if pos != parent.end:
+                raise BoxFormatError("Children beyond box end", parent)
+            open_boxes.pop()
+            current = None
+
+def parse_box_header(structure):
+    """
+    Parse one box's header, leaving the position at its payload, and
+    return the box without children. Returns None at EOF.
+    """
+    header = read_box_header(structure)
+    if header is None:
+        return None
+    boxtype, start, payload_start, end = header
+    if end - start < 4:
         raise BoxFormatError("box too short")
-    payload_start = structure.tell()
-    sz -= (payload_start - start)
-    if end is None:
-        end = structure.tell() + sz
 
     if boxtype == "uuid":
         raise NotImplementedError("boxtype uuid")
@@ -199,17 +446,58 @@ def parse_box(structure):
         payload_start=payload_start,
         start=start,
         end=end)
-    box.parse_children()
-    structure.seek(box.end, os.SEEK_SET)
     return box
 
+def read_box_header(structure):
+    """
+    Returns (boxtype, start, payload_start, end), or None at EOF.
+
+    box_parts_fast.pyx has a compiled version used when it's built.
+    """
+    start = structure.tell()
+    # Size and type are read together; one read per box header.
+    buf = structure.read_upto(_BOX_HDR.size)
+    if len(buf) < _BOX_HDR.size:
+        if len(buf) < 4:
+            return None
+        # Ignore trailing NULLs at EOF.
+        if buf[:4] == b"\x00\x00\x00\x00":
+            return None
+        else:
+            raise EOFError(structure)
+    sz, boxtype = _BOX_HDR.unpack(buf)
+    boxtype = boxtype.decode("ascii")
+
+    payload_start = start + _BOX_HDR.size
+    if sz == 0:
+        # Box extends to EOF.
+        end = structure.get_total_length()
+    elif sz == 1:
+        # Large box.
+        sz = _LARGE.unpack(structure.read(_LARGE.size))[0]
+        payload_start += _LARGE.size
+        end = start + sz
+    else:
+        end = start + sz
+    return (boxtype, start, payload_start, end)
+
+try:
+    from box_parts_fast import read_box_header
+except ImportError:
+    pass
+
 def parse_file(fh):
     structure = StructuredFile(fh)
     return parse_box_list(structure)
 
 def parse_path(path):
     fh = open(path, "rb")
-    return parse_file(fh)
+    try:
+        structure = MappedStructure(fh)
+    except (ValueError, OSError):
+        # Empty or unmappable file.
+        structure = StructuredFile(fh)
+    return parse_box_list(structure)
 
 def box_iter(boxes, boxtype=None):
     to_visit = collections.deque(boxes)
@@ -220,8 +508,23 @@ def box_iter(boxes, boxtype=None):
             continue
         yield box
 
+def index_boxes(boxes):
+    """
+    Returns {boxtype: [box...]} for boxes and all their descendants,
+    each list in the same breadth-first order as box_iter().
+    """
+    index = collections.defaultdict(list)
+    to_visit = collections.deque(boxes)
+    while to_visit:
+        box = to_visit.popleft()
+        to_visit.extend(box.children)
+        index[box.type].append(box)
+    return dict(index)
+
 @register_boxtype("iloc")
 class ItemLocationBox(FullBox):
+    __slots__ = ()
+
     def parse_extents(self):
         """
         Returns {item_id: (extent_offset, extent_length)}.
@@ -234,32 +537,75 @@ class ItemLocationBox(FullBox):
             raise NotImplementedError("iloc version", version)
         self.parse_seek_to_payload() # Spec says flags must be 0; skip.
         structure = self.structure
-        buf = structure.read_int(1)
-        offset_size = buf >> 4
-        length_size = buf & 0x0F
-        buf = structure.read_int(1)
-        base_offset_size = buf >> 4
-        item_count = structure.read_int(2)
-        items = {}
-        for i in range(item_count):
-            item_id = structure.read_int(2)
-            data_reference_index = structure.read_int(2)
-            if data_reference_index != 0:
-                raise NotImplementedError("data_reference_index in other file")
-            base_offset = structure.read_int(base_offset_size)
-            extent_count = structure.read_int(2)
-            extents = []
-            for i in range(extent_count):
-                extent_offset = structure.read_int(offset_size)
-                extent_length = structure.read_int(length_size)
-                extents.append((base_offset + extent_offset, extent_length))
-            items[item_id] = extents
-        if structure.tell() != self.end:
+        # Read the whole payload at once and walk it in memory. iloc
+        # boxes are small; items with many extents make many fields.
+        buf = structure.read(self.end - structure.tell())
+        off = 0
+
+        def read_int(n_bytes):
+            # For the variable-width fields; overruns are caught below.
+            nonlocal off
+            value = int.from_bytes(buf[off:(off + n_bytes)], "big")
+            off += n_bytes
+            return value
+
+        try:
+            sizes, item_count = _ILOC_HDR.unpack_from(buf, off)
+            off += _ILOC_HDR.size
+            offset_size = sizes >> 12
+            length_size = (sizes >> 8) & 0x0F
+            base_offset_size = (sizes >> 4) & 0x0F
+            items = {}
+            for i in range(item_count):
+                item_id, data_reference_index = _ILOC_ITEM.unpack_from(
+                    buf, off)
+                off += _ILOC_ITEM.size
+                if data_reference_index != 0:
+                    raise NotImplementedError(
+                        "data_reference_index in other file")
+                base_offset = read_int(base_offset_size)
+                extent_count = _U16.unpack_from(buf, off)[0]
+                off += 2
+                table_size = extent_count * (offset_size + length_size)
+                if (
+                    extent_count >= _NUMPY_MIN_EXTENTS
+                    and offset_size == length_size
+                    and offset_size in (4, 8)
+                    and _get_numpy() is not None
+                ):
+                    if off + table_size > len(buf):
+                        raise BoxFormatError("Truncated iloc items", self)
+                    table = _numpy.frombuffer(
+                        buf,
+                        dtype=">u{}".format(offset_size),
+                        count=(extent_count * 2),
+                        offset=off,
+                    ).reshape(extent_count, 2)
+                    extents = [
+                        (base_offset + extent_offset, extent_length)
+                        for extent_offset, extent_length in table.tolist()
+                    ]
+                    off += table_size
+                else:
+                    extents = []
+                    for i in range(extent_count):
+                        extent_offset = read_int(offset_size)
+                        extent_length = read_int(length_size)
+                        extents.append(
+                            (base_offset + extent_offset, extent_length))
+                items[item_id] = extents
+        except struct.error:
+            raise BoxFormatError("Truncated iloc items", self)
+        if off > len(buf):
+            raise BoxFormatError("Truncated iloc items", self)
+        if off != len(buf):
             BoxFormatError("Extra content after iloc items")
         return items
 
 @register_boxtype("pitm")
 class PrimaryItemBox(FullBox):
+    __slots__ = ()
+
     def parse_item_id(self):
         """
         Returns the primary item ID.
@@ -274,6 +620,8 @@ class PrimaryItemBox(FullBox):
 
 @register_boxtype("iinf")
 class ItemInfoBox(ContainerMixin, FullBox):
+    __slots__ = ()
+
     def parse_seek_to_payload(self):
         version = self.parse_version()
         super().parse_seek_to_payload()
@@ -284,18 +632,20 @@ class ItemInfoBox(ContainerMixin, FullBox):
 
 @register_boxtype("iref")
 class ItemReferenceBox(ContainerMixin, FullBox):
-    pass
+    __slots__ = ()
 
 @register_boxtype("iprp")
 class ItemPropertiesBox(ContainerMixin, Box):
-    pass
+    __slots__ = ()
 
 @register_boxtype("ipco")
 class ItemPropertyContainerBox(ContainerMixin, Box):
-    pass
+    __slots__ = ()
 
 @register_boxtype("ipma")
 class ItemPropertyAssociationBox(FullBox):
+    __slots__ = ()
+
     def parse_associations(self):
         """
         Returns {"item_id": [index...]}.
@@ -303,36 +653,40 @@ class ItemPropertyAssociationBox(FullBox):
         version = self.parse_version()
         flags = self.parse_flags()
         structure = self.structure
-        entry_count = structure.read_int(4)
-        items = {}
-        for i in range(entry_count):
-            if version == 0:
-                item_id = structure.read_int(2)
-            else:
-                item_id = structure.read_int(4)
-            associations = []
-            association_count = structure.read_int(1)
-            for i in range(association_count):
-                if flags & 0x01:
-                    buf = structure.read_int(2)
-                else:
-                    buf = structure.read_int(1)
-                # Ignore (by masking away) "essential" bit.
-                property_index = buf & 0b01111111
-                associations.append(property_index)
-            items[item_id] = associations
-        if structure.tell() != self.end:
+        buf = structure.read(self.end - structure.tell())
+        item_id_struct = _U16 if version == 0 else _U32
+        index_struct = _U16 if flags & 0x01 else _U8
+        off = 0
+        try:
+            entry_count = _U32.unpack_from(buf, off)[0]
+            off += 4
+            items = {}
+            for i in range(entry_count):
+                item_id = item_id_struct.unpack_from(buf, off)[0]
+                off += item_id_struct.size
+                associations = []
+                association_count = _U8.unpack_from(buf, off)[0]
+                off += 1
+                for i in range(association_count):
+                    buf_int = index_struct.unpack_from(buf, off)[0]
+                    off += index_struct.size
+                    # Ignore (by masking away) "essential" bit.
+                    property_index = buf_int & 0b01111111
+                    associations.append(property_index)
+                items[item_id] = associations
+        except struct.error:
+            raise BoxFormatError("Truncated ipma items", self)
+        if off != len(buf):
             BoxFormatError("Extra content after ipma items")
         return items
 
 @register_boxtype("ispe")
 class ImageSpacialExtentsPropertyBox(FullBox):
+    __slots__ = ()
+
     def parse_resolution(self):
         """
         Returns (width, height) in pixels.
         """
         self.parse_seek_to_payload()
-        return (
-            self.structure.read_int(4),
-            self.structure.read_int(4),
-        )
+        return _RESOLUTION.unpack(self.structure.read(_RESOLUTION.size))
@@ -0,0 +1,89 @@
+# cython: language_level=3
+"""
+Optional compiled box header parsing for box_parts. Build in place with:
+
+    cythonize -i box_parts_fast.pyx
+
+box_parts uses the pure-Python version when this isn't built.
+"""
+from libc.stdint cimport uint32_t, uint64_t
+
+# Big-endian loads as one unaligned load plus a byte swap where the
+# compiler has __builtin_bswap*, else byte-at-a-time shifts.
+cdef extern from *:
+    """
+    #include <stdint.h>
+    #include <string.h>
+
+    #if defined(__GNUC__) && defined(__BYTE_ORDER__) \\
+        && __BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__
+    #define BOX_PARTS_BSWAP32(x) __builtin_bswap32(x)
+    #define BOX_PARTS_BSWAP64(x) __builtin_bswap64(x)
+    #elif defined(__GNUC__) && defined(__BYTE_ORDER__) \\
+        && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    #define BOX_PARTS_BSWAP32(x) (x)
+    #define BOX_PARTS_BSWAP64(x) (x)
+    #endif
+
+    static inline uint32_t box_parts_u32_be(const unsigned char *p) {
+    #ifdef BOX_PARTS_BSWAP32
+        uint32_t raw;
+        memcpy(&raw, p, 4);
+        return BOX_PARTS_BSWAP32(raw);
+    #else
+        return ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16)
+            | ((uint32_t)p[2] << 8) | (uint32_t)p[3];
+    #endif
+    }
+
+    static inline uint64_t box_parts_u64_be(const unsigned char *p) {
+    #ifdef BOX_PARTS_BSWAP64
+        uint64_t raw;
+        memcpy(&raw, p, 8);
+        return BOX_PARTS_BSWAP64(raw);
+    #else
+        return ((uint64_t)box_parts_u32_be(p) << 32)
+            | (uint64_t)box_parts_u32_be(p + 4);
+    #endif
+    }
+    """
+    uint32_t _u32_be "box_parts_u32_be" (const unsigned char *p) nogil
+    uint64_t _u64_be "box_parts_u64_be" (const unsigned char *p) nogil
+
+def read_box_header(structure):
+    """
+    Same as box_parts.read_box_header().
+    """
+    cdef bytes buf
+    cdef const unsigned char *p
+    cdef uint64_t sz
+
+    start = structure.tell()
+    # Size and type are read together; one read per box header.
+    buf = structure.read_upto(8)
+    if len(buf) < 8:
+        if len(buf) < 4:
+            return None
+        # Ignore trailing NULLs at EOF.
+        if buf[:4] == b"\x00\x00\x00\x00":
+            return None
+        else:
+            raise EOFError(structure)
+    p = buf
+    sz = _u32_be(p)
+    boxtype = buf[4:8].decode("ascii")
+
+    payload_start = start + 8
+    if sz == 0:
+        # Box extends to EOF.
+        end = structure.get_total_length()
+    elif sz == 1:
+        # Large box.
+        buf = structure.read(8)
+        p = buf
+        sz = _u64_be(p)
+        payload_start += 8
+        end = start + sz
+    else:
+        end = start + sz
+    return (boxtype, start, payload_start, end)
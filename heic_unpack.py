@@ -71,7 +71,7 @@ def unpack_to(boxes, out_fh):
 def copy_data_annex_b(structure, out_fh, length_size):
     length = structure.read_int(length_size)
     out_fh.write(b"\x00\x00\x00\x01")
-    out_fh.write(structure.read(length))
+    structure.copy_to(out_fh, length)
 
 def get_child_box(box, boxtype):
     """
@@ -32,6 +32,7 @@ def main():
 class HEIF(abc.ABC):
     def __init__(self, boxes):
         self.boxes = boxes
+        self.box_index = box_parts.index_boxes(self.boxes)
         self.mdat = self.get_one_box("mdat", self.boxes)
 
     def unpack_to(self, out_path):
@@ -65,8 +66,8 @@ class HEIF(abc.ABC):
         Recursively find first matching box. Raises if unmatched.
         """
         try:
-            return next(box_parts.box_iter(self.boxes, boxtype=boxtype))
-        except StopIteration:
+            return self.box_index[boxtype][0]
+        except KeyError:
             raise box_parts.BoxFormatError("Missing box", boxtype)
 
     def get_one_box(self, boxtype, boxes):
@@ -87,6 +88,19 @@ class HEIF(abc.ABC):
 class HEIC(HEIF):
     config_boxtype = "hvcC"
 
+    # Limits on NAL units copied per read. Consecutive NAL units are
+    # contiguous apart from their length fields, so a batch is one read.
+    max_batch_units = 256
+    max_batch_bytes = 1024 * 1024
+    # With fewer NAL units in an extent, batching saves too little to
+    # pay for itself; copy them one at a time.
+    min_batched_nal_units = 8
+
+    def __init__(self, boxes):
+        super().__init__(boxes)
+        # Reused by every batch so batches don't allocate.
+        self._batch_buf = bytearray()
+
     def unpack_image(self, out_path, extents, property_boxes):
         config_box = self.get_one_box(self.config_boxtype, property_boxes)
         with open(out_path, "wb") as out_fh:
@@ -130,14 +144,61 @@ class HEIC(HEIF):
         return length_size_minus_one
 
     def copy_video_annex_b(self, structure, length_size, extent_length, out_fh):
+        nal_units = self.parse_nal_units(structure, length_size, extent_length)
+        if len(nal_units) < self.min_batched_nal_units:
+            for nal_unit in nal_units:
+                self.copy_batch_annex_b(structure, [nal_unit], out_fh)
+            return
+        batch = []
+        for offset, length in nal_units:
+            if batch and (
+                len(batch) >= self.max_batch_units
+                or offset + length - batch[0][0] > self.max_batch_bytes
+            ):
+                self.copy_batch_annex_b(structure, batch, out_fh)
+                batch = []
+            batch.append((offset, length))
+        if batch:
+            self.copy_batch_annex_b(structure, batch, out_fh)
+
+    def parse_nal_units(self, structure, length_size, extent_length):
+        """
+        Returns [(payload_offset, length)...] for NAL units in an extent
+        starting at the current position.
+        """
         end = structure.tell() + extent_length
+        nal_units = []
         while structure.tell() < end:
-            self.copy_data_annex_b(structure, out_fh, length_size)
+            length = structure.read_int(length_size)
+            nal_units.append((structure.tell(), length))
+            structure.seek(length, os.SEEK_CUR)
+        return nal_units
+
+    def copy_batch_annex_b(self, structure, batch, out_fh):
+        first_offset = batch[0][0]
+        if len(batch) == 1:
+            # Possibly huge; let copy_to() avoid holding it in RAM.
+            structure.seek(first_offset, os.SEEK_SET)
+            out_fh.write(b"\x00\x00\x00\x01")
+            structure.copy_to(out_fh, batch[0][1])
+            return
+        last_offset, last_length = batch[-1]
+        span = last_offset + last_length - first_offset
+        if len(self._batch_buf) < span:
+            self._batch_buf = bytearray(span)
+        structure.seek(first_offset, os.SEEK_SET)
+        with memoryview(self._batch_buf) as view:
+            if structure.readinto(view[:span]) != span:
+                raise EOFError(structure)
+            for offset, length in batch:
+                start = offset - first_offset
+                out_fh.write(b"\x00\x00\x00\x01")
+                out_fh.write(view[start:(start + length)])
 
     def copy_data_annex_b(self, structure, out_fh, length_size):
         length = structure.read_int(length_size)
         out_fh.write(b"\x00\x00\x00\x01")
-        out_fh.write(structure.read(length))
+        structure.copy_to(out_fh, length)
 
 class AVIC(HEIC):
     config_boxtype = "avcC"
@@ -212,9 +273,7 @@ class AVIF(HEIF):
             structure = self.mdat.structure
             for extent_offset, extent_length in extents:
                 structure.seek(extent_offset, os.SEEK_SET)
-                buf = structure.read(extent_length)
-                assert len(buf) == extent_length
-                fh.write(buf)
+                structure.copy_to(fh, extent_length)
 
 if __name__ == "__main__":
     main()
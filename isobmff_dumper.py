@@ -3,6 +3,9 @@ import sys
 
 import box_parts
 
+# Leaf payloads longer than this are truncated.
+MAX_PAYLOAD_BYTES = 64
+
 def dump_container(fh, boxes):
     def visit(fh, box, level):
         fh.write(" " * level)
@@ -10,13 +13,20 @@ def dump_container(fh, boxes):
         fh.write("\n")
         if not box.children:
             fh.write(" " * (level + 1))
-            fh.write(repr(box.get_payload()))
+            fh.write(format_payload(box))
             fh.write("\n")
         for child in box.children:
             visit(fh, child, level=(level + 1))
     for box in boxes:
         visit(fh, box, 0)
 
+def format_payload(box):
+    buf = box.get_payload(max_bytes=MAX_PAYLOAD_BYTES)
+    remaining = (box.end - box.payload_start) - len(buf)
+    if remaining:
+        return "{}...(+{} bytes)".format(repr(buf), remaining)
+    return repr(buf)
+
 def main():
     path = sys.argv[1]
     boxes = box_parts.parse_path(path)
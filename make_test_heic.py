@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""
+Write a synthetic HEIC whose primary item has many NAL units, plus the
+Annex B data unpacking it should produce, for test.sh.
+
+The real sample images have one NAL unit per extent, so they never
+exercise copying NAL units in batches. The NAL units here are random
+bytes, not decodable HEVC; the unpackers don't look inside them.
+"""
+import random
+import sys
+
+ITEM_ID = 1
+START_CODE = b"\x00\x00\x00\x01"
+
+def box(boxtype, payload):
+    return (8 + len(payload)).to_bytes(4, "big") + boxtype + payload
+
+def full_box(boxtype, payload, version=0, flags=0):
+    header = bytes((version,)) + flags.to_bytes(3, "big")
+    return box(boxtype, header + payload)
+
+def random_bytes(rng, n_bytes):
+    # Random.randbytes() needs Python 3.9.
+    if n_bytes == 0:
+        return b""
+    return rng.getrandbits(8 * n_bytes).to_bytes(n_bytes, "big")
+
+def make_extents(rng):
+    """
+    Returns a list of extents, each a list of NAL unit payloads.
+    """
+    sizes = [rng.randint(0, 400) for i in range(600)]
+    # Units big enough to end a batch or take the in-kernel copy path.
+    sizes[10] = 70000
+    sizes[300] = 2 * 1024 * 1024
+    many = [random_bytes(rng, size) for size in sizes]
+    # Too few units to be worth batching.
+    few = [random_bytes(rng, rng.randint(1, 100)) for i in range(3)]
+    return [many, few]
+
+def make_meta(config_nal, extent_spans):
+    # HEVCDecoderConfigurationRecord with lengthSizeMinusOne = 3 and
+    # one array holding one NAL unit.
+    hvcc = bytes(21) + b"\x03" + b"\x01" + bytes(3)
+    hvcc += len(config_nal).to_bytes(2, "big") + config_nal
+
+    # iloc version 0: 4-byte offset and length, no base offset.
+    iloc = bytes((0x44, 0x00)) + (1).to_bytes(2, "big")
+    iloc += ITEM_ID.to_bytes(2, "big") + (0).to_bytes(2, "big")
+    iloc += len(extent_spans).to_bytes(2, "big")
+    for offset, length in extent_spans:
+        iloc += offset.to_bytes(4, "big") + length.to_bytes(4, "big")
+
+    # ipma version 0: associate the item with property 1 (hvcC).
+    ipma = (1).to_bytes(4, "big") + ITEM_ID.to_bytes(2, "big")
+    ipma += b"\x01" + b"\x01"
+
+    return full_box(b"meta", b"".join((
+        full_box(b"pitm", ITEM_ID.to_bytes(2, "big")),
+        full_box(b"iloc", iloc),
+        box(b"iprp", box(b"ipco", box(b"hvcC", hvcc)) + full_box(b"ipma", ipma)),
+    )))
+
+def main():
+    heic_path, expected_path = sys.argv[1:]
+    rng = random.Random(93)
+    config_nal = random_bytes(rng, 24)
+    extents = make_extents(rng)
+
+    extent_data = [
+        b"".join(len(nal).to_bytes(4, "big") + nal for nal in extent)
+        for extent in extents
+    ]
+    ftyp = box(b"ftyp", b"heic" + bytes(4) + b"mif1heic")
+    # Field widths are fixed, so offsets don't change the meta size.
+    meta_size = len(make_meta(config_nal, [(0, 0)] * len(extents)))
+    offset = len(ftyp) + meta_size + 8
+    extent_spans = []
+    for data in extent_data:
+        extent_spans.append((offset, len(data)))
+        offset += len(data)
+    meta = make_meta(config_nal, extent_spans)
+
+    with open(heic_path, "wb") as fh:
+        fh.write(ftyp)
+        fh.write(meta)
+        fh.write(box(b"mdat", b"".join(extent_data)))
+
+    with open(expected_path, "wb") as fh:
+        fh.write(START_CODE + config_nal)
+        for extent in extents:
+            for nal in extent:
+                fh.write(START_CODE + nal)
+
+if __name__ == "__main__":
+    main()
@@ -30,4 +30,14 @@ cmp test_tmp/*
 
 check1 test_images/link-u/kimono.avif be0eb3e0ca2e8088e291e4f85f75333165dc7720 ./heif_unpack.py
 
+# Many NAL units per extent, which the sample images don't have.
+./make_test_heic.py test_tmp/multi_nal.heic test_tmp/multi_nal_expected
+for c in ./heic_unpack.py ./heif_unpack.py; do
+  $c test_tmp/multi_nal.heic test_tmp/py_out
+  if ! cmp -s test_tmp/py_out test_tmp/multi_nal_expected; then
+    echo "FAILED $c multi_nal.heic"
+    exit 1
+  fi
+done
+
 rm -rf test_tmp